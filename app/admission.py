@@ -0,0 +1,188 @@
+"""Admission control and load shedding for the HTTP layer.
+
+Requests are split in two classes (reads and writes), each with its own
+concurrency limit and bounded wait queue. When a class is saturated, new
+requests wait in the queue up to a deadline; if the queue is full or the
+deadline cannot be met, the request is rejected right away with a 503 and a
+`Retry-After` header instead of piling up on the sync handlers and SQLite.
+
+Configuration (environment variables):
+  - ADMISSION_ENABLED            (default 1)
+  - ADMISSION_READ_CONCURRENCY   (default 32)
+  - ADMISSION_READ_QUEUE         (default 64)
+  - ADMISSION_WRITE_CONCURRENCY  (default 4)
+  - ADMISSION_WRITE_QUEUE        (default 16)
+  - ADMISSION_MAX_WAIT           (seconds, default 2.0)
+  - ADMISSION_STREAM_CONCURRENCY (default 64)
+
+Clients can shorten the wait with an `X-Request-Timeout` header (seconds).
+
+Long-lived SSE streams release their read slot once the response starts;
+they hold a slot of the "stream" gate (no queue) for their whole duration
+instead, taken by the route itself.
+"""
+import asyncio
+import math
+import os
+import time
+from typing import Dict, Optional
+
+from fastapi import Request, status
+from fastapi.responses import JSONResponse
+
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# Endpoints that must stay reachable during overload (monitoring)
+EXEMPT_PATHS = ("/health", "/admission")
+
+TIMEOUT_HEADER = "x-request-timeout"
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except Exception:
+        return default
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except Exception:
+        return default
+
+class AdmissionGate:
+    """Concurrency limit + bounded wait queue for one class of requests."""
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max(0, max_queue)
+        self.max_wait = max(0.0, max_wait)
+        # created lazily so the semaphore belongs to the running event loop
+        self._sem: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+        self.queued = 0
+        self.max_queued_seen = 0
+        self.admitted = 0
+        self.shed_queue_full = 0
+        self.shed_deadline = 0
+        self.shed_timeout = 0
+        # moving average of the time a request holds a slot (seconds)
+        self.avg_service_time = 0.0
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_concurrency)
+        return self._sem
+
+    def expected_wait(self) -> float:
+        """Estimated time before a newly queued request gets a slot."""
+        return (self.queued + 1) * self.avg_service_time / self.max_concurrency
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.expected_wait()))
+
+    async def acquire(self, budget: float) -> bool:
+        """Take a slot, waiting at most `budget` seconds. False if shed."""
+        sem = self._semaphore()
+        if not sem.locked():
+            await sem.acquire()
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+
+        if self.queued >= self.max_queue:
+            self.shed_queue_full += 1
+            return False
+        # no point in queuing if we already know the deadline will be missed
+        if budget <= 0 or self.expected_wait() > budget:
+            self.shed_deadline += 1
+            return False
+
+        self.queued += 1
+        self.max_queued_seen = max(self.max_queued_seen, self.queued)
+        try:
+            await asyncio.wait_for(sem.acquire(), timeout=budget)
+        except asyncio.TimeoutError:
+            self.shed_timeout += 1
+            return False
+        finally:
+            self.queued -= 1
+        self.in_flight += 1
+        self.admitted += 1
+        return True
+
+    def release(self, elapsed: float) -> None:
+        self.in_flight -= 1
+        if self.avg_service_time == 0.0:
+            self.avg_service_time = elapsed
+        else:
+            self.avg_service_time = 0.9 * self.avg_service_time + 0.1 * elapsed
+        self._semaphore().release()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "max_wait": self.max_wait,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queued,
+            "max_queue_depth_seen": self.max_queued_seen,
+            "admitted": self.admitted,
+            "shed": self.shed_queue_full + self.shed_deadline + self.shed_timeout,
+            "shed_queue_full": self.shed_queue_full,
+            "shed_deadline": self.shed_deadline,
+            "shed_timeout": self.shed_timeout,
+            "avg_service_time_ms": round(self.avg_service_time * 1000, 3),
+        }
+
+ENABLED = os.getenv("ADMISSION_ENABLED", "1") not in ("0", "false", "False", "")
+_MAX_WAIT = _env_float("ADMISSION_MAX_WAIT", 2.0)
+
+gates: Dict[str, AdmissionGate] = {
+    "read": AdmissionGate(
+        "read",
+        _env_int("ADMISSION_READ_CONCURRENCY", 32),
+        _env_int("ADMISSION_READ_QUEUE", 64),
+        _MAX_WAIT,
+    ),
+    "write": AdmissionGate(
+        "write",
+        _env_int("ADMISSION_WRITE_CONCURRENCY", 4),
+        _env_int("ADMISSION_WRITE_QUEUE", 16),
+        _MAX_WAIT,
+    ),
+    "stream": AdmissionGate("stream", _env_int("ADMISSION_STREAM_CONCURRENCY", 64), 0, 0.0),
+}
+
+def gate_for(request: Request) -> AdmissionGate:
+    return gates["read" if request.method in READ_METHODS else "write"]
+
+def _request_budget(request: Request, gate: AdmissionGate) -> float:
+    raw = request.headers.get(TIMEOUT_HEADER)
+    if raw is None:
+        return gate.max_wait
+    try:
+        return min(gate.max_wait, float(raw))
+    except ValueError:
+        return gate.max_wait
+
+def get_stats() -> Dict[str, object]:
+    return {"enabled": ENABLED, "gates": {name: g.stats() for name, g in gates.items()}}
+
+async def admission_middleware(request: Request, call_next):
+    if not ENABLED or request.url.path in EXEMPT_PATHS:
+        return await call_next(request)
+
+    gate = gate_for(request)
+    if not await gate.acquire(_request_budget(request, gate)):
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"detail": "Service surchargé, réessayez plus tard."},
+            headers={"Retry-After": str(gate.retry_after())},
+        )
+
+    start = time.perf_counter()
+    try:
+        return await call_next(request)
+    finally:
+        gate.release(time.perf_counter() - start)
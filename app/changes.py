@@ -0,0 +1,200 @@
+"""Change log of the movies catalogue.
+
+Every create / update / delete done through `crud` appends an entry with a
+monotonically increasing `seq`, in the same transaction as the change
+itself. Consumers keep a mirror in sync by asking for the entries after the
+last `seq` they have seen instead of re-reading the whole table.
+
+Retention and compaction (environment variables):
+  - CHANGES_RETENTION_SECONDS  entries older than this are dropped (default 7 days)
+  - CHANGES_MAX_ENTRIES        at most this many rows are kept after compaction (default 100000)
+  - CHANGES_COMPACT_EVERY      run compaction every N writes (default 1000, 0 = never)
+
+Compaction first removes entries superseded by a later entry for the same
+movie: every entry carries a full snapshot, so only the latest one matters
+to a consumer. Retention then drops the oldest remaining rows. Entries
+dropped by retention move the "truncated" horizon; a consumer whose `since`
+is below it has missed changes and must resync.
+
+Movies loaded by `seed_from_csv` are not in the log: a new consumer first
+notes `latest_seq`, then pages `GET /movies`, then follows the log from
+that seq.
+
+`crud` signals `notifier` after each commit, so SSE streams read the log
+only when something was written instead of polling it. The notifier is
+in-process: writes made by another process are picked up when a stream
+re-reads the log on its keepalive timer.
+"""
+import asyncio
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import logger
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except Exception:
+        return default
+
+RETENTION_SECONDS = _env_int("CHANGES_RETENTION_SECONDS", 7 * 24 * 3600)
+MAX_ENTRIES = _env_int("CHANGES_MAX_ENTRIES", 100000)
+COMPACT_EVERY = _env_int("CHANGES_COMPACT_EVERY", 1000)
+
+class ChangeNotifier:
+    """Wakes up the waiting SSE streams when a change is committed.
+
+    `notify` is called from the worker threads running `crud`; waiters live
+    on the event loop, hence the call_soon_threadsafe.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+        # highest seq committed by this process
+        self.seq = 0
+
+    def notify(self, seq: int) -> None:
+        with self._lock:
+            self.seq = max(self.seq, seq)
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # loop already closed
+                pass
+
+    async def wait(self, seen: int, timeout: float) -> bool:
+        """Wait until a seq above `seen` is committed. False on timeout."""
+        event = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), event)
+        with self._lock:
+            if self.seq > seen:
+                return True
+            self._waiters.add(waiter)
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+notifier = ChangeNotifier()
+
+def _snapshot(movie: models.Movie) -> str:
+    return json.dumps({c.name: getattr(movie, c.name) for c in movie.__table__.columns})
+
+def record_change(db: Session, op: str, movie: models.Movie) -> models.MovieChange:
+    """Add a change entry to the current transaction (the caller commits).
+
+    `movie` must already have its id (flush before calling on creates).
+    """
+    entry = models.MovieChange(
+        movie_id=movie.id,
+        op=op,
+        data=None if op == "delete" else _snapshot(movie),
+    )
+    db.add(entry)
+    db.flush()
+    return entry
+
+def maybe_compact(db: Session, seq: int) -> None:
+    """Run compaction every COMPACT_EVERY sequence numbers."""
+    if COMPACT_EVERY > 0 and seq % COMPACT_EVERY == 0:
+        try:
+            compact_changes(db)
+        except Exception as e:
+            db.rollback()
+            logger.warning(f"Change log compaction failed: {e}")
+
+def latest_seq(db: Session) -> int:
+    return db.query(func.max(models.MovieChange.seq)).scalar() or 0
+
+def truncated_through(db: Session) -> int:
+    state = db.get(models.ChangeLogState, 1)
+    return state.truncated_through if state else 0
+
+def get_changes(db: Session, since: int = 0, limit: int = 100) -> List[models.MovieChange]:
+    return (
+        db.query(models.MovieChange)
+        .filter(models.MovieChange.seq > since)
+        .order_by(models.MovieChange.seq.asc())
+        .limit(limit)
+        .all()
+    )
+
+def to_dict(entry: models.MovieChange) -> Dict[str, object]:
+    return {
+        "seq": entry.seq,
+        "movie_id": entry.movie_id,
+        "op": entry.op,
+        "changed_at": entry.changed_at,
+        "data": json.loads(entry.data) if entry.data else None,
+    }
+
+def _truncate_through(db: Session, cutoff: int) -> int:
+    """Delete entries with seq <= cutoff and move the truncated horizon."""
+    removed = (
+        db.query(models.MovieChange)
+        .filter(models.MovieChange.seq <= cutoff)
+        .delete(synchronize_session=False)
+    )
+    state = db.get(models.ChangeLogState, 1)
+    if state is None:
+        state = models.ChangeLogState(id=1, truncated_through=0)
+        db.add(state)
+    state.truncated_through = max(state.truncated_through or 0, cutoff)
+    return removed
+
+def compact_changes(db: Session, now: Optional[datetime] = None) -> Dict[str, int]:
+    """Drop superseded entries, then apply retention. Returns removal counts."""
+    now = now or datetime.utcnow()
+
+    # 1) compaction: keep only the latest entry per movie
+    latest_per_movie = (
+        select(func.max(models.MovieChange.seq))
+        .group_by(models.MovieChange.movie_id)
+    )
+    superseded = (
+        db.query(models.MovieChange)
+        .filter(~models.MovieChange.seq.in_(latest_per_movie))
+        .delete(synchronize_session=False)
+    )
+
+    # 2) retention by age
+    truncated = 0
+    if RETENTION_SECONDS > 0:
+        cutoff = (
+            db.query(func.max(models.MovieChange.seq))
+            .filter(models.MovieChange.changed_at < now - timedelta(seconds=RETENTION_SECONDS))
+            .scalar()
+        )
+        if cutoff:
+            truncated += _truncate_through(db, cutoff)
+
+    # 3) retention by number of rows: drop the oldest ones beyond MAX_ENTRIES
+    if MAX_ENTRIES > 0:
+        excess = db.query(func.count(models.MovieChange.seq)).scalar() - MAX_ENTRIES
+        if excess > 0:
+            cutoff = (
+                db.query(models.MovieChange.seq)
+                .order_by(models.MovieChange.seq.asc())
+                .offset(excess - 1)
+                .limit(1)
+                .scalar()
+            )
+            truncated += _truncate_through(db, cutoff)
+
+    db.commit()
+    logger.info(f"Change log compaction: truncated={truncated} superseded={superseded}")
+    return {"truncated": truncated, "superseded": superseded}
@@ -1,7 +1,8 @@
 from typing import List, Optional
 from sqlalchemy.orm import Session
 from sqlalchemy import asc, desc
-from . import models, schemas
+from . import models, schemas, changes
+from .suggest import title_index
 
 def get_movie(db: Session, movie_id: int) -> Optional[models.Movie]:
     return db.query(models.Movie).filter(models.Movie.id == movie_id).first()
@@ -60,8 +61,13 @@ def create_movie(db: Session, movie: schemas.MovieCreate) -> Optional[models.Mov
 
     db_movie = models.Movie(**movie.dict())
     db.add(db_movie)
+    db.flush()
+    seq = changes.record_change(db, "create", db_movie).seq
     db.commit()
+    changes.notifier.notify(seq)
+    changes.maybe_compact(db, seq)
     db.refresh(db_movie)
+    title_index.upsert(db_movie)
     return db_movie
 
 def update_movie(db: Session, movie_id: int, movie: schemas.MovieUpdate) -> Optional[models.Movie]:
@@ -69,16 +75,29 @@ def update_movie(db: Session, movie_id: int, movie: schemas.MovieUpdate) -> Opti
     if not db_movie:
         return None
     update_data = movie.dict(exclude_unset=True)
-    for k, v in update_data.items():
+    changed = {k: v for k, v in update_data.items() if getattr(db_movie, k) != v}
+    if not changed:
+        # nothing to write: no commit, no change log entry
+        return db_movie
+    for k, v in changed.items():
         setattr(db_movie, k, v)
+    db.flush()
+    seq = changes.record_change(db, "update", db_movie).seq
     db.commit()
+    changes.notifier.notify(seq)
+    changes.maybe_compact(db, seq)
     db.refresh(db_movie)
+    title_index.upsert(db_movie)
     return db_movie
 
 def delete_movie(db: Session, movie_id: int) -> bool:
     db_movie = get_movie(db, movie_id)
     if not db_movie:
         return False
+    seq = changes.record_change(db, "delete", db_movie).seq
     db.delete(db_movie)
     db.commit()
+    changes.notifier.notify(seq)
+    changes.maybe_compact(db, seq)
+    title_index.remove(movie_id)
     return True
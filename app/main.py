@@ -1,7 +1,8 @@
 from fastapi import FastAPI, Request, status
 from fastapi.responses import JSONResponse
 from .routes import router as movies_router
-from .database import init_db, SessionLocal
+from . import admission, profiling
+from .database import init_db, SessionLocal, engine
 from .database import logger as db_logger
 from .database import seed_from_csv
 import os
@@ -18,6 +19,11 @@ logging.basicConfig(
 
 app = FastAPI(title="Movies API")
 
+# Tables créées dès l'import (idempotent) : movie_changes doit exister même
+# quand l'app est utilisée sans événement startup (TestClient dans scripts/)
+init_db()
+app.router.route_class = profiling.TimedRoute
+
 # --- MIDDLEWARE GLOBAL DE GESTION D'ERREURS ---
 # Intercepte toute exception Python pour renvoyer un JSON propre
 @app.middleware("http")
@@ -32,6 +38,18 @@ async def global_exception_handler(request: Request, call_next):
             content={"detail": "Une erreur interne est survenue. Consultez le fichier errors.log."}
         )
 
+# --- PROFILAGE À LA DEMANDE (désactivé par défaut : aucun middleware installé) ---
+# Déclaré avant l'admission : le temps passé en file d'attente n'est pas compté.
+if profiling.ENABLED:
+    profiling.install(engine)
+    app.middleware("http")(profiling.profiling_middleware)
+    app.include_router(profiling.debug_router)
+
+# --- CONTRÔLE D'ADMISSION / DÉLESTAGE ---
+# Déclaré après le handler global : il l'enveloppe, donc une surcharge renvoie
+# directement un 503 + Retry-After sans passer par la gestion d'erreurs.
+app.middleware("http")(admission.admission_middleware)
+
 app.include_router(movies_router)
 
 # --- ENDPOINT /health ---
@@ -50,6 +68,12 @@ def health_check():
     finally:
         db.close()
 
+# --- ENDPOINT /admission ---
+@app.get("/admission", tags=["System"])
+def admission_stats():
+    """Profondeur des files d'attente et compteurs de délestage par classe de routes."""
+    return admission.get_stats()
+
 @app.on_event("startup")
 def on_startup():
     init_db()
@@ -78,6 +102,16 @@ def on_startup():
         except Exception as e:
             db_logger.warning(f"Error during auto-seed: {e}")
 
+    # Index d'autocomplétion des titres (maintenu ensuite par crud)
+    from .suggest import title_index
+    db = SessionLocal()
+    try:
+        title_index.load(db)
+    except Exception as e:
+        db_logger.warning(f"Could not build title index: {e}")
+    finally:
+        db.close()
+
 @app.get("/")
 def root():
     return {"message": "Welcome to the API Movies"}
\ No newline at end of file
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Float, CheckConstraint
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, Float, DateTime, Text, CheckConstraint
 from .database import Base
 
 class Movie(Base):
@@ -20,3 +21,27 @@ class Movie(Base):
         CheckConstraint('rotten_tomatoes >= 0 AND rotten_tomatoes <= 100', name='ck_rotten_range'),
         CheckConstraint('profitability >= 0', name='ck_profitability_nonneg'),
     )
+
+class MovieChange(Base):
+    """One entry of the change log (create / update / delete of a movie)."""
+    __tablename__ = 'movie_changes'
+
+    # AUTOINCREMENT so sequence numbers are never reused after compaction
+    seq = Column(Integer, primary_key=True)
+    movie_id = Column(Integer, index=True, nullable=False)
+    op = Column(String, nullable=False)
+    # JSON snapshot of the movie after the change (NULL for deletes)
+    data = Column(Text, nullable=True)
+    changed_at = Column(DateTime, default=datetime.utcnow, index=True, nullable=False)
+
+    __table_args__ = (
+        CheckConstraint("op IN ('create', 'update', 'delete')", name='ck_change_op'),
+        {'sqlite_autoincrement': True},
+    )
+
+class ChangeLogState(Base):
+    """Single-row table: highest seq dropped by retention (clients below it must resync)."""
+    __tablename__ = 'change_log_state'
+
+    id = Column(Integer, primary_key=True)
+    truncated_through = Column(Integer, nullable=False, default=0)
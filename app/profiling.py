@@ -0,0 +1,399 @@
+"""Opt-in request profiling.
+
+When enabled, every request gets a `Server-Timing` header with a per-phase
+breakdown:
+  - db:        time spent executing SQL (cursor execute)
+  - handler:   endpoint code minus SQL (query building, ORM hydration, ...)
+  - serialize: FastAPI work around the endpoint (dependencies, validation of
+               the response model, JSON encoding)
+  - total:     whole request as seen by the middleware
+
+A request is also profiled when it carries the `X-Profile-Token` header
+with the configured token, or when it is picked by the sampling rate.
+Profiles are stored as `.prof` files (pstats format) and can be listed /
+downloaded from `/debug/profiles` (same header required).
+
+Only the profiled request's own work is recorded: each step of its route
+handler coroutine on the event loop, and each of its threadpool hops
+(dependencies such as `get_db`, the sync endpoint, response validation).
+Profilers are per thread and only switched on around those segments, so
+concurrent requests do not show up in the profile. Limitations:
+  - middlewares (admission, error handler) are not part of the profile;
+  - from Python 3.12 cProfile is interpreter-wide, so the pure Python
+    `profile` module is used instead: it is much slower and inflates
+    absolute times (compare ratios, not milliseconds);
+  - wall-clock times still include waiting for the GIL: the metadata of
+    each profile records how many requests were in flight (`in_flight`,
+    `max_in_flight`) to tell a slow request from a busy process.
+
+Configuration (environment variables):
+  - PROFILING_ENABLED      (default 0: middleware, listeners and debug routes are not installed)
+  - PROFILING_TOKEN        secret expected in `X-Profile-Token` (empty = header trigger and debug routes disabled)
+  - PROFILING_SAMPLE_RATE  fraction of requests profiled automatically (default 0.0)
+  - PROFILING_DIR          where profiles are stored (default ./profiles)
+  - PROFILING_MAX_STORED   number of profiles kept, oldest removed first (default 50)
+
+The list of stored profiles lives in memory, so it only covers profiles
+taken since the process started.
+"""
+import asyncio
+import cProfile
+import functools
+import io
+import os
+import profile
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+import anyio.to_thread
+from fastapi import APIRouter, Header, HTTPException, Query, Request
+from fastapi.responses import FileResponse, PlainTextResponse
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+from starlette.concurrency import run_in_threadpool
+
+from .database import logger
+
+TOKEN_HEADER = "x-profile-token"
+DEBUG_PREFIX = "/debug/profiles"
+
+ENABLED = os.getenv("PROFILING_ENABLED", "0") not in ("0", "false", "False", "")
+TOKEN = os.getenv("PROFILING_TOKEN", "")
+try:
+    SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", 0.0))
+except Exception:
+    SAMPLE_RATE = 0.0
+PROFILE_DIR = os.getenv("PROFILING_DIR", os.path.join(".", "profiles"))
+try:
+    MAX_STORED = int(os.getenv("PROFILING_MAX_STORED", 50))
+except Exception:
+    MAX_STORED = 50
+
+class RequestTimings:
+    """Phase timings (seconds) and optional profilers of the current request."""
+
+    def __init__(self, profile: bool):
+        self.db = 0.0
+        self.endpoint = 0.0
+        self.route = 0.0
+        self.timed_route = False
+        self.profile = profile
+        # one profiler per profiled segment (loop step or threadpool hop)
+        self.profilers: List[Any] = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def run_profiled(self, func: Callable, *args):
+        profiler = PROFILER_CLASS()
+        try:
+            return profiler.runcall(func, *args)
+        finally:
+            # close the profiler's stack now, or the time until the profile
+            # is stored would be charged to it
+            profiler.create_stats()
+            self.profilers.append(profiler)
+
+    def server_timing(self, total: float) -> str:
+        parts = [f"db;dur={self.db * 1000:.2f}"]
+        if self.timed_route:
+            parts.append(f"handler;dur={max(0.0, self.endpoint - self.db) * 1000:.2f}")
+            parts.append(f"serialize;dur={max(0.0, self.route - self.endpoint) * 1000:.2f}")
+        parts.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(parts)
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+
+class _ThreadProfile(profile.Profile):
+    """`profile.Profile` that resynchronises its stack instead of asserting.
+
+    From 3.12 sys.setprofile can miss return events (callbacks run by
+    finalizers for instance); the stock class then raises "Bad call" /
+    "Bad return" inside the profiled code.
+    """
+
+    def _unwind(self, frame) -> None:
+        """Close the frames above `frame` whose return event was lost."""
+        cur = self.cur
+        while cur and not isinstance(cur[-2], profile.Profile.fake_frame):
+            if cur[-2] is frame:
+                break
+            cur = cur[-1]
+        else:
+            return
+        while self.cur[-2] is not frame:
+            profile.Profile.trace_dispatch_return(self, self.cur[-2], 0)
+
+    def trace_dispatch_call(self, frame, t):
+        if self.cur and frame.f_back is not self.cur[-2]:
+            self._unwind(frame.f_back)
+        fcode = frame.f_code
+        fn = (fcode.co_filename, fcode.co_firstlineno, fcode.co_name)
+        self.cur = (t, 0, 0, fn, frame, self.cur)
+        cc, ns, tt, ct, callers = self.timings.get(fn, (0, -1, 0, 0, {}))
+        self.timings[fn] = cc, ns + 1, tt, ct, callers
+        return 1
+
+    def trace_dispatch_return(self, frame, t):
+        if frame is not self.cur[-2]:
+            self._unwind(frame)
+            if frame is not self.cur[-2]:
+                # return of a frame entered before the profiler started
+                return 0
+        return profile.Profile.trace_dispatch_return(self, frame, t)
+
+    dispatch = dict(profile.Profile.dispatch)
+    dispatch.update({"call": trace_dispatch_call, "return": trace_dispatch_return,
+                     "c_exception": trace_dispatch_return, "c_return": trace_dispatch_return})
+
+# Profilers must be per thread so that only the profiled request is seen.
+# cProfile is per thread before 3.12; from 3.12 it is interpreter-wide
+# (sys.monitoring), while `profile` (sys.setprofile) stays per thread.
+PROFILER_CLASS = cProfile.Profile if sys.version_info < (3, 12) else _ThreadProfile
+
+# One profiled request at a time, to bound the overhead
+_profiler_lock = threading.Lock()
+
+# Requests currently in the middleware, and the profiled ones among them
+_in_flight = 0
+_profiled_in_flight: List[RequestTimings] = []
+
+# id -> metadata of stored profiles, oldest first
+_profiles: "OrderedDict[str, Dict[str, object]]" = OrderedDict()
+_profiles_lock = threading.Lock()
+
+# --- PHASE TIMING HOOKS ---
+
+class _ProfiledSteps:
+    """Awaitable running each step of `coro` under the request's loop profiler.
+
+    Between two steps the coroutine is suspended and the event loop runs
+    other requests, which therefore stay out of the profile.
+    """
+
+    def __init__(self, coro, timings: RequestTimings):
+        self.coro = coro
+        self.timings = timings
+
+    def __await__(self):
+        run_profiled = self.timings.run_profiled
+        send, value = self.coro.send, None
+        while True:
+            try:
+                yielded = run_profiled(send, value)
+            except StopIteration as e:
+                return e.value
+            try:
+                send, value = self.coro.send, (yield yielded)
+            except BaseException as e:
+                send, value = self.coro.throw, e
+
+_original_run_sync = anyio.to_thread.run_sync
+
+async def _run_sync(func: Callable, *args, **kwargs):
+    """anyio.to_thread.run_sync that profiles the hops of the profiled request."""
+    timings = _current.get()
+    if timings is not None and timings.profile:
+        func = functools.partial(timings.run_profiled, func)
+    return await _original_run_sync(func, *args, **kwargs)
+
+def _timed_endpoint(endpoint: Callable) -> Callable:
+    """Wrap an endpoint to measure its own duration."""
+    if getattr(endpoint, "_timed_endpoint", False):
+        # include_router() rebuilds routes from the already wrapped endpoint
+        return endpoint
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def async_wrapper(*args, **kwargs):
+            timings = _current.get()
+            if timings is None:
+                return await endpoint(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                timings.endpoint += time.perf_counter() - start
+        async_wrapper._timed_endpoint = True
+        return async_wrapper
+
+    @functools.wraps(endpoint)
+    def sync_wrapper(*args, **kwargs):
+        timings = _current.get()
+        if timings is None:
+            return endpoint(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            timings.endpoint += time.perf_counter() - start
+    sync_wrapper._timed_endpoint = True
+    return sync_wrapper
+
+class TimedRoute(APIRoute):
+    """APIRoute that reports endpoint and serialization time to the current request."""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        super().__init__(path, _timed_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def timed_handler(request: Request):
+            timings = _current.get()
+            if timings is None:
+                return await handler(request)
+            timings.timed_route = True
+            start = time.perf_counter()
+            try:
+                if timings.profile:
+                    return await _ProfiledSteps(handler(request), timings)
+                return await handler(request)
+            finally:
+                timings.route += time.perf_counter() - start
+
+        return timed_handler
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("profiling_query_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = _current.get()
+    starts = conn.info.get("profiling_query_start")
+    if timings is not None and starts:
+        timings.db += time.perf_counter() - starts.pop()
+
+def install(engine) -> None:
+    """Install the SQL timing listeners and the threadpool hook (PROFILING_ENABLED only)."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    # FastAPI / Starlette send every threadpool hop through this function
+    anyio.to_thread.run_sync = _run_sync
+
+# --- STORAGE ---
+
+def _store_profile(profilers: List[Any], meta: Dict[str, object]) -> bool:
+    stats = None
+    for p in profilers:
+        try:
+            if stats is None:
+                stats = pstats.Stats(p)
+            else:
+                stats.add(p)
+        except TypeError:
+            # profiler without any recorded call
+            continue
+    if stats is None:
+        return False
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stats.dump_stats(os.path.join(PROFILE_DIR, f"{meta['id']}.prof"))
+    with _profiles_lock:
+        _profiles[meta["id"]] = meta
+        while len(_profiles) > MAX_STORED:
+            old_id, _ = _profiles.popitem(last=False)
+            try:
+                os.remove(os.path.join(PROFILE_DIR, f"{old_id}.prof"))
+            except OSError:
+                pass
+    return True
+
+def _should_profile(request: Request) -> bool:
+    if request.url.path.startswith(DEBUG_PREFIX):
+        # reading profiles must not create (and rotate out) profiles
+        return False
+    token = request.headers.get(TOKEN_HEADER)
+    if TOKEN and token == TOKEN:
+        return True
+    return SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+
+# --- MIDDLEWARE ---
+
+async def profiling_middleware(request: Request, call_next):
+    global _in_flight
+
+    # if another request holds the profiler, this one only gets timings
+    profile = _should_profile(request) and _profiler_lock.acquire(blocking=False)
+    timings = RequestTimings(profile)
+
+    _in_flight += 1
+    timings.in_flight = timings.max_in_flight = _in_flight
+    for other in _profiled_in_flight:
+        other.max_in_flight = max(other.max_in_flight, _in_flight)
+    if profile:
+        _profiled_in_flight.append(timings)
+
+    token = _current.set(timings)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        total = time.perf_counter() - start
+        _current.reset(token)
+        _in_flight -= 1
+        if profile:
+            _profiled_in_flight.remove(timings)
+            _profiler_lock.release()
+
+    response.headers["Server-Timing"] = timings.server_timing(total)
+    if timings.profilers:
+        profile_id = uuid.uuid4().hex
+        meta = {
+            "id": profile_id,
+            "method": request.method,
+            "path": request.url.path,
+            "status_code": response.status_code,
+            "duration_ms": round(total * 1000, 3),
+            "server_timing": response.headers["Server-Timing"],
+            "in_flight": timings.in_flight,
+            "max_in_flight": timings.max_in_flight,
+            "created_at": datetime.utcnow().isoformat(),
+        }
+        try:
+            if await run_in_threadpool(_store_profile, timings.profilers, meta):
+                response.headers["X-Profile-Id"] = profile_id
+        except Exception as e:
+            logger.warning(f"Could not store profile for {request.url.path}: {e}")
+    return response
+
+# --- DEBUG ENDPOINTS ---
+
+def _require_token(token: Optional[str]) -> None:
+    if not TOKEN or token != TOKEN:
+        raise HTTPException(status_code=403, detail="Jeton de profilage invalide.")
+
+debug_router = APIRouter(prefix=DEBUG_PREFIX, tags=["System"])
+
+@debug_router.get("/")
+def list_profiles(x_profile_token: Optional[str] = Header(None)):
+    """Liste des profils enregistrés, du plus récent au plus ancien."""
+    _require_token(x_profile_token)
+    with _profiles_lock:
+        return list(reversed(_profiles.values()))
+
+@debug_router.get("/{profile_id}")
+def download_profile(
+    profile_id: str,
+    format: str = Query("prof", regex="^(prof|text)$", description="Fichier pstats brut ou résumé texte"),
+    limit: int = Query(50, ge=1, le=500, description="Nombre de fonctions dans le résumé texte"),
+    x_profile_token: Optional[str] = Header(None),
+):
+    """Télécharge un profil (format pstats, lisible avec `python -m pstats` ou snakeviz)."""
+    _require_token(x_profile_token)
+    with _profiles_lock:
+        known = profile_id in _profiles
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.prof")
+    if not known or not os.path.exists(path):
+        raise HTTPException(status_code=404, detail=f"Profil {profile_id} introuvable.")
+    if format == "text":
+        out = io.StringIO()
+        pstats.Stats(path, stream=out).sort_stats("cumulative").print_stats(limit)
+        return PlainTextResponse(out.getvalue())
+    return FileResponse(path, media_type="application/octet-stream", filename=f"{profile_id}.prof")
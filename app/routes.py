@@ -1,11 +1,18 @@
 from typing import List, Optional
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+import json
+import time
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
-from . import crud, schemas, models
+from . import admission, crud, schemas, models, changes
+from .suggest import title_index
+from .profiling import TimedRoute
 from .database import SessionLocal
 
-router = APIRouter(prefix="/movies", tags=["movies"])
+router = APIRouter(prefix="/movies", tags=["movies"], route_class=TimedRoute)
 
 # Liste des genres autorisés pour la règle métier (400)
 ALLOWED_GENRES = ["Action", "Drama", "Comedy", "Sci-Fi", "Romance"]
@@ -59,6 +66,145 @@ def read_movies(
 
     return query.offset(skip).limit(limit).all()
 
+# --- AUTOCOMPLÉTION ---
+
+@router.get("/suggest", response_model=List[schemas.MovieSuggestion])
+def suggest_movies(
+    prefix: str = Query(..., min_length=1, max_length=120, description="Début du titre (casse et accents ignorés)"),
+    limit: int = Query(10, ge=1, le=50, description="Nombre maximum de suggestions"),
+):
+    """
+    Suggestions de titres depuis l'index en mémoire (construit au démarrage), classées par recettes mondiales.
+    """
+    return title_index.suggest(prefix, limit)
+
+# --- FLUX DE CHANGEMENTS ---
+
+# Commentaire SSE envoyé périodiquement pour garder la connexion ouverte
+SSE_KEEPALIVE_SECONDS = 15
+
+def _check_since(db: Session, since: int):
+    """410 si des changements après `since` ont été purgés (resynchronisation nécessaire)."""
+    if since < changes.truncated_through(db):
+        raise HTTPException(
+            status_code=410,
+            detail={
+                "message": "Changements purgés : resynchronisez via GET /movies puis reprenez à latest_seq.",
+                "latest_seq": changes.latest_seq(db),
+            },
+        )
+
+@router.get("/changes", response_model=schemas.MovieChangePage)
+def read_changes(
+    since: Optional[int] = Query(None, ge=0, description="Dernier seq déjà reçu (défaut : maintenant)"),
+    limit: int = Query(100, ge=1, le=1000, description="Nombre maximum de changements"),
+    db: Session = Depends(get_db),
+):
+    """
+    Changements (création, modification, suppression) postérieurs à `since`, par ordre de seq.
+    Les films importés depuis le CSV ne sont pas dans le journal : un nouveau client appelle
+    d'abord cette route sans `since` pour noter `latest_seq`, parcourt ensuite GET /movies,
+    puis reprend avec `since=latest_seq`.
+    """
+    if since is None:
+        since = changes.latest_seq(db)
+    _check_since(db, since)
+    entries = changes.get_changes(db, since, limit + 1)
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+    return {
+        "changes": [changes.to_dict(e) for e in entries],
+        "next_since": entries[-1].seq if entries else since,
+        "latest_seq": changes.latest_seq(db),
+        "has_more": has_more,
+    }
+
+def _poll_changes(since: int, limit: int):
+    db = SessionLocal()
+    try:
+        if since < changes.truncated_through(db):
+            return None
+        return [changes.to_dict(e) for e in changes.get_changes(db, since, limit)]
+    finally:
+        db.close()
+
+async def _change_events(request: Request, since: int):
+    last_sent = time.monotonic()
+    while not await request.is_disconnected():
+        # lu avant la requête : un commit pendant la lecture réveille l'attente ci-dessous
+        seen = changes.notifier.seq
+        entries = await run_in_threadpool(_poll_changes, since, 100)
+        if entries is None:
+            # Le client est trop en retard : il doit se resynchroniser
+            yield f"event: reset\ndata: {json.dumps({'since': since})}\n\n"
+            return
+        for e in entries:
+            since = e["seq"]
+            yield f"id: {since}\ndata: {json.dumps(jsonable_encoder(e))}\n\n"
+        if entries:
+            last_sent = time.monotonic()
+            continue
+        if time.monotonic() - last_sent >= SSE_KEEPALIVE_SECONDS:
+            yield ": keepalive\n\n"
+            last_sent = time.monotonic()
+        # Pas de scrutation : réveil au prochain commit (ou au keepalive, pour les
+        # écritures faites par un autre processus)
+        await changes.notifier.wait(seen, SSE_KEEPALIVE_SECONDS - (time.monotonic() - last_sent))
+
+class _StreamResponse(StreamingResponse):
+    """Rend le slot de la porte "stream" à la fin du flux, même s'il n'a jamais démarré."""
+
+    def __init__(self, *args, gate: admission.AdmissionGate, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.gate = gate
+        self.started = time.perf_counter()
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.gate.release(time.perf_counter() - self.started)
+
+@router.get("/changes/stream")
+async def stream_changes(
+    request: Request,
+    since: Optional[int] = Query(None, ge=0, description="Dernier seq déjà reçu (défaut : maintenant)"),
+):
+    """
+    Flux Server-Sent Events des changements. Reprend après l'en-tête `Last-Event-ID` si présent.
+    """
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+
+    # Nombre de flux ouverts limité (ils durent, pas de file d'attente)
+    gate = admission.gates["stream"]
+    if not await gate.acquire(0):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Trop de flux ouverts, réessayez plus tard.",
+            headers={"Retry-After": str(SSE_KEEPALIVE_SECONDS)},
+        )
+    try:
+        db = SessionLocal()
+        try:
+            if since is None:
+                since = await run_in_threadpool(changes.latest_seq, db)
+            else:
+                await run_in_threadpool(_check_since, db, since)
+        finally:
+            db.close()
+    except BaseException:
+        gate.release(0.0)
+        raise
+
+    return _StreamResponse(
+        _change_events(request, since),
+        gate=gate,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 @router.get("/{movie_id}", response_model=schemas.MovieRead)
 def read_movie(movie_id: int, db: Session = Depends(get_db)):
     """
@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field
-from typing import Optional
+from typing import Any, Dict, List, Optional
+from datetime import datetime
 
 class MovieBase(BaseModel):
     # Validation de format (422 si non respecté)
@@ -27,4 +28,24 @@ class MovieUpdate(BaseModel):
     studio: Optional[str] = Field(None, min_length=2)
     audience_score: Optional[int] = Field(None, ge=0, le=100)
     rotten_tomatoes: Optional[int] = Field(None, ge=0, le=100)
-    year: Optional[int] = Field(None, ge=1900)
\ No newline at end of file
+    year: Optional[int] = Field(None, ge=1900)
+
+class MovieSuggestion(BaseModel):
+    id: int
+    title: str
+    worldwide_gross: Optional[float] = None
+
+class MovieChangeRead(BaseModel):
+    seq: int
+    movie_id: int
+    op: str
+    changed_at: datetime
+    # État complet du film après le changement (None pour une suppression)
+    data: Optional[Dict[str, Any]] = None
+
+class MovieChangePage(BaseModel):
+    changes: List[MovieChangeRead]
+    # À renvoyer comme `since` pour la page suivante
+    next_since: int
+    latest_seq: int
+    has_more: bool
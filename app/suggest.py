@@ -0,0 +1,290 @@
+"""In-memory prefix index for title autocomplete.
+
+Titles are normalized (accents stripped, case folded, whitespace collapsed)
+and kept in a sorted array. A prefix lookup is a binary search for the range
+of keys starting with the prefix, then a top-N by `worldwide_gross` over
+that range.
+
+Prefixes matching more than HEAVY_RANGE titles (short ones like "a" or
+"the") keep a precomputed ranked list of ids, so no lookup ever scans more
+than HEAVY_RANGE entries. The number of such prefixes is bounded by about
+n / HEAVY_RANGE per character of depth.
+
+The sorted arrays and ranked lists (the base) are never modified. Writes go
+to a small delta: a sorted buffer of inserted titles and a set of base ids
+that are deleted or replaced (tombstones). A lookup merges the base and the
+delta. A write copies the delta only, so it costs O(delta); once the delta
+holds more than REBUILD_THRESHOLD entries, a background thread merges it
+into a new base.
+
+Readers never lock: a write builds a new (base, delta) state under a writer
+lock and swaps it in with a single assignment.
+"""
+import heapq
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left, insort
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import models
+from .database import logger
+
+# largest `limit` served from the precomputed lists (route accepts up to 50)
+MAX_LIMIT = 50
+# ranked ids kept per heavy prefix; slack so tombstones rarely force a scan
+TOP_KEEP = 2 * MAX_LIMIT
+# prefixes matching more titles than this get a precomputed ranked list
+HEAVY_RANGE = 256
+# delta size (inserts + tombstones) that triggers a rebuild of the base
+REBUILD_THRESHOLD = 1024
+# upper bound sentinel for the prefix range in the sorted keys
+_RANGE_END = "\U0010ffff"
+# rank of titles without worldwide gross (returned as None)
+_NO_GROSS = float("-inf")
+
+# id -> (display title, worldwide gross, normalized key)
+Info = Tuple[str, Optional[float], str]
+
+def normalize(text: Optional[str]) -> str:
+    if not text:
+        return ""
+    if text.isascii():
+        return " ".join(text.lower().split())
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return " ".join(stripped.casefold().split())
+
+def _rank(gross: Optional[float]) -> float:
+    return _NO_GROSS if gross is None else gross
+
+class _Base:
+    """Sorted titles with the ranked lists of heavy prefixes (never modified)."""
+    __slots__ = ("keys", "ids", "gross", "info", "top")
+
+    def __init__(self, keys: List[str], ids: array, gross: array, info: Dict[int, Info]):
+        # parallel arrays sorted by (key, id)
+        self.keys = keys
+        self.ids = ids
+        self.gross = gross
+        self.info = info
+        # heavy prefix -> ids ranked by gross
+        self.top: Dict[str, Tuple[int, ...]] = {}
+
+    def range(self, prefix: str) -> Tuple[int, int]:
+        lo = bisect_left(self.keys, prefix)
+        return lo, bisect_left(self.keys, prefix + _RANGE_END, lo)
+
+    def ranked(self, lo: int, hi: int, n: int, removed: FrozenSet[int] = frozenset()) -> List[int]:
+        positions = range(lo, hi)
+        if removed:
+            positions = (i for i in positions if self.ids[i] not in removed)
+        best = heapq.nlargest(n, positions, key=self.gross.__getitem__)
+        return [self.ids[i] for i in best]
+
+    def candidates(self, prefix: str, n: int, removed: FrozenSet[int]) -> List[int]:
+        """The `n` best live ids of the base starting with `prefix`."""
+        top = self.top.get(prefix)
+        if top is not None:
+            ranked = [i for i in top if i not in removed] if removed else list(top)
+            # the list is complete unless tombstones ate into it
+            if len(ranked) >= n or len(top) == len(ranked):
+                return ranked[:n]
+        lo, hi = self.range(prefix)
+        return self.ranked(lo, hi, n, removed)
+
+def _build_top(base: _Base) -> None:
+    stack = [("", 0, len(base.keys))]
+    while stack:
+        prefix, lo, hi = stack.pop()
+        if prefix:
+            base.top[prefix] = tuple(base.ranked(lo, hi, TOP_KEEP))
+        depth = len(prefix)
+        i = lo
+        while i < hi:
+            if len(base.keys[i]) <= depth:
+                i += 1
+                continue
+            child = base.keys[i][:depth + 1]
+            j = bisect_left(base.keys, child + _RANGE_END, i, hi)
+            if j - i > HEAVY_RANGE:
+                stack.append((child, i, j))
+            i = j
+
+def _make_base(keys: List[str], ids: array, info: Dict[int, Info]) -> _Base:
+    """Build a base from keys / ids sorted by (key, id) and the info of these ids."""
+    base = _Base(keys, ids, array("d", (_rank(info[i][1]) for i in ids)), info)
+    _build_top(base)
+    return base
+
+class _Delta:
+    """Writes not merged into the base yet (copied on each write)."""
+    __slots__ = ("keys", "info", "removed")
+
+    def __init__(self, keys: List[Tuple[str, int]], info: Dict[int, Info], removed: FrozenSet[int]):
+        # (key, id) of inserted titles, sorted
+        self.keys = keys
+        self.info = info
+        # base ids deleted or replaced by an entry of `info`
+        self.removed = removed
+
+    def __len__(self) -> int:
+        return len(self.keys) + len(self.removed)
+
+    def write(self, base: _Base, movie_id: int, new: Optional[Info]) -> "_Delta":
+        """New delta where `movie_id` is removed and, if `new` is given, inserted again."""
+        keys, info, removed = list(self.keys), dict(self.info), self.removed
+        old = info.pop(movie_id, None)
+        if old is not None:
+            del keys[bisect_left(keys, (old[2], movie_id))]
+        if movie_id in base.info and movie_id not in removed:
+            removed = removed | {movie_id}
+        if new is not None:
+            insort(keys, (new[2], movie_id))
+            info[movie_id] = new
+        return _Delta(keys, info, removed)
+
+    def candidates(self, prefix: str, n: int) -> List[int]:
+        lo = bisect_left(self.keys, (prefix,))
+        hi = bisect_left(self.keys, (prefix + _RANGE_END,), lo)
+        ids = [movie_id for _, movie_id in self.keys[lo:hi]]
+        return heapq.nlargest(n, ids, key=lambda i: _rank(self.info[i][1]))
+
+_EMPTY_DELTA = _Delta([], {}, frozenset())
+
+class _IndexState:
+    """Immutable snapshot of the index (replaced as a whole on each write)."""
+    __slots__ = ("base", "delta")
+
+    def __init__(self, base: _Base, delta: _Delta):
+        self.base = base
+        self.delta = delta
+
+    def info(self, movie_id: int) -> Info:
+        info = self.delta.info.get(movie_id)
+        return info if info is not None else self.base.info[movie_id]
+
+    def merged(self) -> _Base:
+        """New base holding the base and the delta (O(n), run off the request path)."""
+        base, delta = self.base, self.delta
+        live = ((key, movie_id) for key, movie_id in zip(base.keys, base.ids)
+                if movie_id not in delta.removed)
+        keys, ids = [], array("q")
+        for key, movie_id in heapq.merge(live, delta.keys):
+            keys.append(key)
+            ids.append(movie_id)
+        info = {i: base.info[i] for i in base.ids if i not in delta.removed}
+        info.update(delta.info)
+        return _make_base(keys, ids, info)
+
+class TitleIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._state = _IndexState(_make_base([], array("q"), {}), _EMPTY_DELTA)
+        # writes done since the running load / rebuild took its snapshot (None: none running)
+        self._pending: Optional[List[Tuple[int, Optional[Info]]]] = None
+        self.loaded = False
+
+    def __len__(self) -> int:
+        state = self._state
+        return len(state.base.keys) - len(state.delta.removed) + len(state.delta.keys)
+
+    def load(self, db: Session) -> None:
+        """Build the index from the `movies` table (no-op once loaded).
+
+        Writers are not blocked meanwhile: writes made after the query started
+        are replayed on the new base before it is swapped in.
+        """
+        with self._load_lock:
+            if self.loaded:
+                return
+            with self._lock:
+                pending = self._pending = []
+            try:
+                base = self._load_base(db)
+            except Exception:
+                with self._lock:
+                    if self._pending is pending:
+                        self._pending = None
+                raise
+            with self._lock:
+                self._swap(base, pending)
+                self.loaded = True
+
+    @staticmethod
+    def _load_base(db: Session) -> _Base:
+        rows = (
+            db.query(models.Movie.id, models.Movie.title, models.Movie.worldwide_gross)
+            .order_by(models.Movie.id)
+            .all()
+        )
+        info = {movie_id: (title, gross, normalize(title)) for movie_id, title, gross in rows}
+        # stable sort: titles with the same key stay in id order
+        ids = array("q", sorted(info, key=lambda i: info[i][2]))
+        keys = [info[i][2] for i in ids]
+        return _make_base(keys, ids, info)
+
+    def _swap(self, base: _Base, pending: List[Tuple[int, Optional[Info]]]) -> None:
+        """Install `base` with the writes of `pending` on top (caller holds the lock)."""
+        delta = _EMPTY_DELTA
+        for movie_id, new in pending:
+            delta = delta.write(base, movie_id, new)
+        self._state = _IndexState(base, delta)
+        self._pending = None
+
+    def _write(self, movie_id: int, new: Optional[Info]) -> None:
+        """Remove `movie_id` and, if `new` is given, insert it again."""
+        with self._lock:
+            state = self._state
+            delta = state.delta.write(state.base, movie_id, new)
+            self._state = _IndexState(state.base, delta)
+            if self._pending is not None:
+                self._pending.append((movie_id, new))
+            elif len(delta) > REBUILD_THRESHOLD:
+                self._pending = []
+                threading.Thread(target=self._rebuild, args=(self._state, self._pending),
+                                 name="title-index-rebuild", daemon=True).start()
+
+    def _rebuild(self, snapshot: _IndexState, pending: list) -> None:
+        """Merge the delta of `snapshot` into a new base, then replay later writes."""
+        try:
+            base = snapshot.merged()
+        except Exception as e:
+            logger.warning(f"Title index rebuild failed: {e}")
+            with self._lock:
+                if self._pending is pending:
+                    self._pending = None
+            return
+        with self._lock:
+            # a load started in the meantime replaces this base anyway
+            if self._pending is pending:
+                self._swap(base, pending)
+
+    def upsert(self, movie: models.Movie) -> None:
+        self._write(movie.id, (movie.title, movie.worldwide_gross, normalize(movie.title)))
+
+    def remove(self, movie_id: int) -> None:
+        self._write(movie_id, None)
+
+    def suggest(self, prefix: str, limit: int = 10) -> List[Dict[str, object]]:
+        """Titles starting with `prefix`, highest worldwide gross first."""
+        key = normalize(prefix)
+        if not key:
+            return []
+        if prefix[-1].isspace():
+            # "star " is a finished word: it matches "Star Wars", not "Stardust"
+            key += " "
+        state = self._state
+        ids = state.base.candidates(key, limit, state.delta.removed)
+        ids += state.delta.candidates(key, limit)
+        result = []
+        for movie_id in ids:
+            title, gross, key = state.info(movie_id)
+            result.append((-_rank(gross), key, movie_id, title, gross))
+        result.sort()
+        return [{"id": r[2], "title": r[3], "worldwide_gross": r[4]} for r in result[:limit]]
+
+title_index = TitleIndex()
@@ -0,0 +1,230 @@
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from fastapi.testclient import TestClient
+
+# Ajout de la racine du projet pour les imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+# Profilage activé avant l'import de l'app (lu au chargement du module)
+os.environ.setdefault("PROFILING_ENABLED", "1")
+os.environ.setdefault("PROFILING_TOKEN", "check-token")
+os.environ.setdefault("PROFILING_DIR", tempfile.mkdtemp(prefix="profiles_"))
+
+from app.main import app
+from app import admission, changes, profiling, routes
+from app.database import SessionLocal
+
+client = TestClient(app)
+
+def check(label, ok):
+    print(f"   {'OK ' if ok else 'KO '} {label}")
+    return ok
+
+def test_admission():
+    print("=== CONTRÔLE D'ADMISSION ===\n")
+
+    # Classe "read" saturée : 1 slot déjà pris, file d'attente de taille 0
+    print("1) 503 + Retry-After quand les lectures sont saturées")
+    saved = admission.gates["read"]
+    gate = admission.AdmissionGate("read", 1, 0, 0.5)
+    gate._sem = asyncio.Semaphore(0)
+    gate.avg_service_time = 3.2
+    admission.gates["read"] = gate
+    try:
+        r = client.get("/movies/")
+        check(f"status {r.status_code} (attendu 503)", r.status_code == 503)
+        check(f"Retry-After={r.headers.get('Retry-After')} (attendu 4)", r.headers.get("Retry-After") == "4")
+        # /health et /admission restent accessibles pendant la surcharge
+        check("/health non délesté", client.get("/health").status_code == 200)
+        stats = client.get("/admission").json()
+        check(f"shed={stats['gates']['read']['shed']} (attendu 1)", stats["gates"]["read"]["shed"] == 1)
+
+        # Les écritures ont leur propre limite
+        print("\n2) Écriture admise pendant la saturation des lectures")
+        r = client.delete("/movies/999999")
+        check(f"DELETE : {r.status_code} (attendu 404)", r.status_code == 404)
+    finally:
+        admission.gates["read"] = saved
+
+def test_changes():
+    print("\n=== FLUX DE CHANGEMENTS ===\n")
+    base = client.get("/movies/changes").json()["latest_seq"]
+    ids = []
+    for title in ("Feature Check A", "Feature Check B", "Feature Check C"):
+        r = client.post("/movies/", json={"title": title, "genre": "Drama", "studio": "Check Studio", "year": 2020})
+        ids.append(r.json()["id"])
+
+    print("1) Pagination avec since / has_more")
+    page = client.get("/movies/changes", params={"since": base, "limit": 2}).json()
+    check(f"2 changements, has_more={page['has_more']} (attendu True)", len(page["changes"]) == 2 and page["has_more"])
+    page = client.get("/movies/changes", params={"since": page["next_since"], "limit": 2}).json()
+    check(f"page suivante : {len(page['changes'])} changement (attendu 1), has_more={page['has_more']}",
+          len(page["changes"]) == 1 and not page["has_more"])
+    check("ops = create", all(c["op"] == "create" for c in page["changes"]))
+
+    print("\n2) PUT sans modification : pas d'entrée dans le journal")
+    latest = page["latest_seq"]
+    client.put(f"/movies/{ids[0]}", json={})
+    client.put(f"/movies/{ids[0]}", json={"studio": "Check Studio"})
+    after = client.get("/movies/changes", params={"since": latest}).json()
+    check(f"latest_seq inchangé ({after['latest_seq']})", after["latest_seq"] == latest and not after["changes"])
+
+    print("\n3) 410 après rétention")
+    saved = changes.MAX_ENTRIES
+    changes.MAX_ENTRIES = 1
+    db = SessionLocal()
+    try:
+        changes.compact_changes(db)
+    finally:
+        db.close()
+        changes.MAX_ENTRIES = saved
+    r = client.get("/movies/changes", params={"since": base})
+    check(f"status {r.status_code} (attendu 410)", r.status_code == 410)
+
+    print("\n4) Flux SSE réveillé par le commit, sans scrutation")
+    idle_polls, event, delay = asyncio.run(_stream_wakeup())
+    check(f"{idle_polls} lecture(s) de la base au repos (attendu 1)", idle_polls == 1)
+    check(f"événement reçu en {delay:.2f}s (keepalive {routes.SSE_KEEPALIVE_SECONDS}s)",
+          '"op": "create"' in event and delay < 2)
+    ids.append(int(event.split('"movie_id": ')[1].split(",")[0]))
+
+    print("\n5) Nombre de flux SSE limité")
+    saved = admission.gates["stream"]
+    gate = admission.AdmissionGate("stream", 1, 0, 0.0)
+    gate._sem = asyncio.Semaphore(0)
+    admission.gates["stream"] = gate
+    try:
+        r = client.get("/movies/changes/stream")
+        check(f"status {r.status_code} (attendu 503), Retry-After={r.headers.get('Retry-After')}",
+              r.status_code == 503 and r.headers.get("Retry-After") is not None)
+    finally:
+        admission.gates["stream"] = saved
+    asyncio.run(_stream_until_disconnect())
+    check(f"slot rendu après la déconnexion (in_flight={saved.in_flight})", saved.in_flight == 0)
+
+    for movie_id in ids:
+        client.delete(f"/movies/{movie_id}")
+
+class _ConnectedRequest:
+    async def is_disconnected(self):
+        return False
+
+async def _stream_wakeup():
+    polls = []
+    poll_changes = routes._poll_changes
+    routes._poll_changes = lambda since, limit: polls.append(since) or poll_changes(since, limit)
+    since = client.get("/movies/changes").json()["latest_seq"]
+    events = routes._change_events(_ConnectedRequest(), since)
+    try:
+        first = asyncio.ensure_future(events.__anext__())
+        await asyncio.sleep(0.5)
+        idle_polls = len(polls)
+        start = time.perf_counter()
+        await asyncio.to_thread(client.post, "/movies/", json={"title": "Feature Check Stream", "genre": "Drama",
+                                                               "studio": "Check Studio", "year": 2020})
+        event = await asyncio.wait_for(first, 5)
+        return idle_polls, event, time.perf_counter() - start
+    finally:
+        routes._poll_changes = poll_changes
+        await events.aclose()
+
+async def _stream_until_disconnect():
+    async def receive():
+        await asyncio.sleep(0.2)
+        return {"type": "http.disconnect"}
+    async def send(message):
+        pass
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+             "scheme": "http", "path": "/movies/changes/stream", "raw_path": b"/movies/changes/stream",
+             "root_path": "", "query_string": b"", "headers": [(b"host", b"test")],
+             "server": ("test", 80), "client": ("test", 1234)}
+    await asyncio.wait_for(app(scope, receive, send), 5)
+
+def test_suggest():
+    print("\n=== AUTOCOMPLÉTION ===\n")
+    r = client.post("/movies/", json={"title": "Éléphant Rouge Check", "genre": "Drama", "studio": "Check Studio",
+                                      "year": 2020, "worldwide_gross": 12.5})
+    movie_id = r.json()["id"]
+    r = client.post("/movies/", json={"title": "Elephant Rouge Check Bis", "genre": "Drama", "studio": "Check Studio",
+                                      "year": 2020})
+    other_id = r.json()["id"]
+
+    def titles(prefix):
+        return [m["title"] for m in client.get("/movies/suggest", params={"prefix": prefix, "limit": 10}).json()]
+
+    print("1) Casse et accents ignorés, classement par recettes")
+    for prefix in ("elephant rouge", "ÉLÉPHANT ROUGE", "éLePhAnT   rOuge"):
+        found = titles(prefix)
+        check(f"'{prefix}' -> {found}", found == ["Éléphant Rouge Check", "Elephant Rouge Check Bis"])
+    found = titles("elephant rouge check ")
+    check(f"'elephant rouge check ' (espace final) -> {found}", found == ["Elephant Rouge Check Bis"])
+    bis = client.get("/movies/suggest", params={"prefix": "elephant rouge check bis"}).json()
+    check(f"recettes inconnues -> {bis[0]['worldwide_gross']} (attendu None)", bis[0]["worldwide_gross"] is None)
+
+    print("\n2) Index mis à jour après PUT")
+    client.put(f"/movies/{movie_id}", json={"title": "Zèbre Bleu Check"})
+    check(f"ancien titre absent : {titles('elephant rouge')}", titles("elephant rouge") == ["Elephant Rouge Check Bis"])
+    check(f"nouveau titre présent : {titles('zebre bleu')}", titles("zebre bleu") == ["Zèbre Bleu Check"])
+
+    print("\n3) Index mis à jour après DELETE")
+    client.delete(f"/movies/{movie_id}")
+    client.delete(f"/movies/{other_id}")
+    check(f"'zebre bleu' -> {titles('zebre bleu')}", titles("zebre bleu") == [])
+    check(f"'elephant rouge' -> {titles('elephant rouge')}", titles("elephant rouge") == [])
+
+def test_profiling():
+    print("\n=== PROFILAGE ===\n")
+    token = {"X-Profile-Token": profiling.TOKEN}
+    r = client.post("/movies/", json={"title": "Profiling Check", "genre": "Drama", "studio": "Check Studio", "year": 2020})
+    movie_id = r.json()["id"]
+
+    print("1) Server-Timing avec les quatre phases sur les routes /movies")
+    for path in ("/movies/", f"/movies/{movie_id}"):
+        header = client.get(path).headers.get("Server-Timing", "")
+        phases = [part.split(";")[0].strip() for part in header.split(",")]
+        check(f"{path} -> {phases}", phases == ["db", "handler", "serialize", "total"])
+
+    print("\n2) Profil déclenché par l'en-tête X-Profile-Token")
+    r = client.get(f"/movies/{movie_id}", headers=token)
+    profile_id = r.headers.get("X-Profile-Id")
+    check(f"X-Profile-Id={profile_id}", profile_id is not None)
+    listed = client.get("/debug/profiles/", headers=token).json()
+    check("profil listé", [p["id"] for p in listed][:1] == [profile_id])
+    text = client.get(f"/debug/profiles/{profile_id}", params={"format": "text", "limit": 500}, headers=token).text
+    check("le profil contient read_movie et get_movie", "read_movie" in text and "get_movie" in text)
+    r = client.get(f"/debug/profiles/{profile_id}", headers=token)
+    check(f"téléchargement .prof : {r.status_code}", r.status_code == 200 and len(r.content) > 0)
+
+    print("\n3) Lire les profils n'en crée pas de nouveaux")
+    again = client.get("/debug/profiles/", headers=token).json()
+    check(f"{len(again)} profil(s) (attendu {len(listed)})", len(again) == len(listed))
+    check("403 sans jeton", client.get("/debug/profiles/").status_code == 403)
+
+    print("\n4) Profil limité à la requête profilée malgré la concurrence")
+    profile_id, meta = asyncio.run(_profile_under_load(token))
+    text = client.get(f"/debug/profiles/{profile_id}", params={"format": "text", "limit": 500}, headers=token).text
+    check("get_db et la validation de la réponse présents", "get_db" in text and "validate" in text)
+    check("aucune trace des requêtes /movies/changes concurrentes", "read_changes" not in text)
+    check(f"max_in_flight={meta.get('max_in_flight')} (attendu > 1)", (meta.get("max_in_flight") or 0) > 1)
+
+    client.delete(f"/movies/{movie_id}")
+
+async def _profile_under_load(token):
+    import httpx
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as aclient:
+        others = [aclient.get("/movies/changes") for _ in range(20)]
+        responses = await asyncio.gather(aclient.get("/movies/", headers=token), *others)
+        profile_id = responses[0].headers.get("X-Profile-Id")
+        listed = (await aclient.get("/debug/profiles/", headers=token)).json()
+    meta = next((p for p in listed if p["id"] == profile_id), {})
+    return profile_id, meta
+
+if __name__ == "__main__":
+    test_admission()
+    test_changes()
+    test_suggest()
+    test_profiling()